@@ -5,13 +5,18 @@ This module provides functionality to interact with Google Calendar API,
 including fetching free/busy slots and creating events.
 """
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
 from typing import List, Tuple, Dict, Any, Optional
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from google.auth.transport.requests import Request
+import asyncio
+import calendar
+import heapq
 import os
 import logging
+import threading
+import time
 from dotenv import load_dotenv
 
 # Set up logging
@@ -23,6 +28,76 @@ load_dotenv()
 
 # Constants
 MINIMUM_INTERVAL_MINUTES = 30
+MINIMUM_INTERVAL_SECONDS = MINIMUM_INTERVAL_MINUTES * 60
+FREEBUSY_MAX_CALENDARS = 50
+FREEBUSY_CACHE_TTL_SECONDS = 180
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# Busy intervals per (calendar id, UTC day), stored as (expiry, intervals).
+# Lookups run in worker threads, so every access goes through the lock.
+_free_busy_cache: Dict[Tuple[str, date], Tuple[float, List[Tuple[int, int]]]] = {}
+_free_busy_cache_lock = threading.Lock()
+# Bumped on every invalidation so in-flight lookups don't cache stale results
+_free_busy_cache_generation = 0
+
+def to_timestamp(dt: datetime) -> int:
+    """Convert a datetime (naive values are taken as UTC) to Unix seconds."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def to_iso(timestamp: int) -> str:
+    """Format Unix seconds as a UTC ISO 8601 string with a 'Z' suffix."""
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).replace(tzinfo=None).isoformat() + 'Z'
+
+
+def parse_rfc3339(value: str) -> int:
+    """Parse an RFC 3339 timestamp as returned by the Calendar API into Unix seconds."""
+    # Fast path for the fixed-width 'YYYY-MM-DDTHH:MM:SSZ' form freebusy returns
+    if len(value) == 20 and value[19] == 'Z':
+        return calendar.timegm((
+            int(value[0:4]), int(value[5:7]), int(value[8:10]),
+            int(value[11:13]), int(value[14:16]), int(value[17:19])
+        ))
+    return to_timestamp(datetime.fromisoformat(value.replace('Z', '+00:00')))
+
+
+def first_value(entries: Optional[List[Dict[str, Any]]], key: str) -> str:
+    """Return `key` from the first entry of a People API field, or ''."""
+    return entries[0].get(key, '') if entries else ''
+
+
+def prune_free_busy_cache(now: float) -> None:
+    """Evict cache entries whose TTL has passed so past days don't accumulate."""
+    with _free_busy_cache_lock:
+        for key in [key for key, (expiry, _) in _free_busy_cache.items() if expiry <= now]:
+            del _free_busy_cache[key]
+
+
+def utc_days(start: int, end: int) -> List[date]:
+    """List the UTC days touched by the range [start, end)."""
+    first = start - start % SECONDS_PER_DAY
+    return [
+        datetime.fromtimestamp(day_start, tz=timezone.utc).date()
+        for day_start in range(first, max(end, start + 1), SECONDS_PER_DAY)
+    ]
+
+
+def invalidate_free_busy_cache(start: int, end: int) -> None:
+    """
+    Drop cached busy intervals on the days in [start, end).
+    
+    Entries are dropped for every calendar, not just the one written to, since
+    events are created on 'primary' and its real calendar id isn't known here.
+    """
+    global _free_busy_cache_generation
+    days = set(utc_days(start, end))
+    with _free_busy_cache_lock:
+        _free_busy_cache_generation += 1
+        for key in [key for key in _free_busy_cache if key[1] in days]:
+            del _free_busy_cache[key]
+
 
 class GoogleCalendarService:
     """Service class for Google Calendar operations."""
@@ -38,43 +113,51 @@ class GoogleCalendarService:
         self.service = build('calendar', 'v3', credentials=self.creds)
 
     @staticmethod
-    def merge_intervals(intervals: List[Tuple[datetime, datetime]]) -> List[Tuple[datetime, datetime]]:
-        """Merge overlapping or adjacent time intervals."""
+    def merge_intervals(intervals: List[Tuple[int, int]],
+                        already_sorted: bool = False,
+                        gap: int = 0) -> List[Tuple[int, int]]:
+        """
+        Merge overlapping or adjacent time intervals given as Unix timestamps.
+        
+        Intervals separated by at most `gap` seconds are merged as well; the
+        default only merges intervals that overlap or touch.
+        """
         if not intervals:
             return []
 
-        # Sort intervals by start time
-        intervals.sort(key=lambda x: x[0])
+        # Sort intervals by start time unless the caller already has
+        if not already_sorted:
+            intervals.sort(key=lambda x: x[0])
 
         merged = []
-        current_interval = intervals[0]
+        current_start, current_end = intervals[0]
 
         for next_start, next_end in intervals[1:]:
-            current_start, current_end = current_interval
-            
-            # If current interval overlaps or is adjacent to the next one
-            if current_end + timedelta(minutes=MINIMUM_INTERVAL_MINUTES) >= next_start:
-                # Merge them
-                current_interval = (
-                    min(current_start, next_start),
-                    max(current_end, next_end)
-                )
+            # Next interval lies entirely inside the current one
+            if next_end <= current_end:
+                continue
+            # If current interval overlaps or is within `gap` of the next one, extend it
+            if next_start <= current_end + gap:
+                current_end = next_end
             else:
-                merged.append(current_interval)
-                current_interval = (next_start, next_end)
+                merged.append((current_start, current_end))
+                current_start, current_end = next_start, next_end
         
-        merged.append(current_interval)
+        merged.append((current_start, current_end))
         return merged
 
     @staticmethod
-    def get_free_intervals(busy_intervals: List[Tuple[datetime, datetime]], 
-                         start_time: datetime, 
-                         end_time: datetime) -> List[Tuple[datetime, datetime]]:
-        """Calculate free time slots between busy intervals."""
+    def get_free_intervals(busy_intervals: List[Tuple[int, int]], 
+                         start_time: int, 
+                         end_time: int,
+                         already_sorted: bool = False) -> List[Tuple[int, int]]:
+        """Calculate free time slots between busy intervals, as Unix timestamps."""
         if not busy_intervals:
             return [(start_time, end_time)]
 
-        merged = GoogleCalendarService.merge_intervals(busy_intervals)
+        # Strict merge: gaps shorter than MINIMUM_INTERVAL_SECONDS are dropped by the
+        # caller's minimum-length filter, while gaps of exactly that length are kept
+        merged = GoogleCalendarService.merge_intervals(busy_intervals, already_sorted)
         free_intervals = []
         last_end = start_time
 
@@ -88,6 +171,156 @@ class GoogleCalendarService:
             
         return free_intervals
 
+    def list_calendar_ids(self) -> List[str]:
+        """Return the ids of every calendar in the user's calendar list."""
+        calendar_ids = []
+        page_token = None
+
+        while True:
+            calendars_result = self.service.calendarList().list(
+                fields='items/id,nextPageToken',
+                pageToken=page_token
+            ).execute()
+            calendar_ids.extend(cal['id'] for cal in calendars_result.get('items', []))
+
+            page_token = calendars_result.get('nextPageToken')
+            if not page_token:
+                break
+
+        return calendar_ids
+
+    def query_free_busy(self, time_min: str, time_max: str,
+                        calendar_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Query free/busy information for any number of calendars.
+        
+        The freebusy endpoint accepts at most FREEBUSY_MAX_CALENDARS calendars
+        per query, so larger lists are split into chunks and sent as one batch request.
+        
+        Args:
+            time_min: Start of the range as an RFC 3339 string
+            time_max: End of the range as an RFC 3339 string
+            calendar_ids: Calendars to query
+            
+        Returns:
+            Mapping of calendar id to its freebusy entry
+        """
+        def query(chunk):
+            return self.service.freebusy().query(
+                body={
+                    "timeMin": time_min,
+                    "timeMax": time_max,
+                    "items": [{"id": cal_id} for cal_id in chunk]
+                },
+                fields='calendars(busy)'
+            )
+
+        # A single chunk gains nothing from the multipart batch encoding
+        if len(calendar_ids) <= FREEBUSY_MAX_CALENDARS:
+            return query(calendar_ids).execute().get('calendars', {})
+
+        calendars = {}
+        errors = []
+
+        def collect(request_id, response, exception):
+            if exception is not None:
+                errors.append(exception)
+            else:
+                calendars.update(response.get('calendars', {}))
+
+        batch = self.service.new_batch_http_request(callback=collect)
+        for i in range(0, len(calendar_ids), FREEBUSY_MAX_CALENDARS):
+            batch.add(query(calendar_ids[i:i + FREEBUSY_MAX_CALENDARS]))
+        batch.execute()
+
+        if errors:
+            raise errors[0]
+        return calendars
+
+    def get_busy_intervals(self, calendar_ids: List[str], start: int,
+                           end: int) -> Dict[str, List[Tuple[int, int]]]:
+        """
+        Get busy intervals per calendar within [start, end), using the cache.
+        
+        Busy blocks are cached per calendar and UTC day for
+        FREEBUSY_CACHE_TTL_SECONDS; only days missing from the cache are queried.
+        
+        Args:
+            calendar_ids: Calendars to look up
+            start: Start of the range as Unix seconds
+            end: End of the range as Unix seconds
+            
+        Returns:
+            Mapping of calendar id to its busy intervals as Unix timestamps,
+            sorted by start time
+        """
+        days = utc_days(start, end)
+        now = time.monotonic()
+        prune_free_busy_cache(now)
+
+        # Snapshot fresh entries so concurrent invalidation can't remove them mid-lookup
+        cached = {}
+        missing = []
+        with _free_busy_cache_lock:
+            generation = _free_busy_cache_generation
+            for cal_id in calendar_ids:
+                for day in days:
+                    expiry, intervals = _free_busy_cache.get((cal_id, day), (0.0, None))
+                    if expiry > now:
+                        cached[(cal_id, day)] = intervals
+                    else:
+                        missing.append((cal_id, day))
+
+        if missing:
+            # Query the whole span of missing days in one request
+            missing_days = [day for _, day in missing]
+            fetch_start = datetime.combine(min(missing_days), datetime.min.time())
+            fetch_end = datetime.combine(max(missing_days), datetime.min.time()) + timedelta(days=1)
+            fetch_calendars = list(dict.fromkeys(cal_id for cal_id, _ in missing))
+
+            free_busy = self.query_free_busy(
+                fetch_start.isoformat() + 'Z',
+                fetch_end.isoformat() + 'Z',
+                fetch_calendars
+            )
+
+            expiry = now + FREEBUSY_CACHE_TTL_SECONDS
+            fetched_days = utc_days(to_timestamp(fetch_start), to_timestamp(fetch_end))
+            for cal_id in fetch_calendars:
+                busy_by_day = {day: [] for day in fetched_days}
+                for busy in free_busy.get(cal_id, {}).get('busy', []):
+                    busy_start = parse_rfc3339(busy['start'])
+                    busy_end = parse_rfc3339(busy['end'])
+                    # Split blocks spanning midnight across the days they touch
+                    for day in utc_days(busy_start, busy_end):
+                        if day in busy_by_day:
+                            day_start = to_timestamp(datetime.combine(day, datetime.min.time()))
+                            busy_by_day[day].append((
+                                max(busy_start, day_start),
+                                min(busy_end, day_start + SECONDS_PER_DAY)
+                            ))
+                # Freebusy doesn't document its order; sort once so lookups can k-way merge
+                for intervals in busy_by_day.values():
+                    intervals.sort()
+                with _free_busy_cache_lock:
+                    # Skip the write if an invalidation raced with the query
+                    store = generation == _free_busy_cache_generation
+                    for day, intervals in busy_by_day.items():
+                        if store:
+                            _free_busy_cache[(cal_id, day)] = (expiry, intervals)
+                        cached[(cal_id, day)] = intervals
+
+        busy_intervals = {}
+        for cal_id in calendar_ids:
+            intervals = []
+            for day in days:
+                for busy_start, busy_end in cached[(cal_id, day)]:
+                    busy_start, busy_end = max(busy_start, start), min(busy_end, end)
+                    if busy_start < busy_end:
+                        intervals.append((busy_start, busy_end))
+            busy_intervals[cal_id] = intervals
+        return busy_intervals
+
     async def get_free_slots(self, days_ahead: int = 7) -> List[Dict[str, str]]:
         """
         Get free time slots for the next N days.
@@ -99,43 +332,32 @@ class GoogleCalendarService:
             List of dictionaries with 'start' and 'end' ISO format datetime strings
         """
         try:
-            now = datetime.utcnow()
-            end = now + timedelta(days=days_ahead)
+            now = to_timestamp(datetime.utcnow())
+            end = now + days_ahead * SECONDS_PER_DAY
             
             # Get list of calendars
-            calendars_result = self.service.calendarList().list().execute()
-            calendar_ids = [cal['id'] for cal in calendars_result.get('items', [])]
-            
-            # Prepare free/busy request
-            free_busy_request = {
-                "timeMin": now.isoformat() + 'Z',
-                "timeMax": end.isoformat() + 'Z',
-                "items": [{"id": cal_id} for cal_id in calendar_ids]
-            }
+            calendar_ids = await asyncio.to_thread(self.list_calendar_ids)
             
             # Get busy intervals
-            free_busy = self.service.freebusy().query(body=free_busy_request).execute()
-            
-            # Process busy intervals
-            busy_intervals = []
-            for cal_data in free_busy.get('calendars', {}).values():
-                for busy in cal_data.get('busy', []):
-                    busy_intervals.append((
-                        datetime.fromisoformat(busy['start'].replace('Z', '+00:00')),
-                        datetime.fromisoformat(busy['end'].replace('Z', '+00:00'))
-                    ))
+            busy_by_calendar = await asyncio.to_thread(
+                self.get_busy_intervals, calendar_ids, now, end
+            )
+            # Each calendar's busy list is already sorted, so a k-way merge suffices
+            busy_intervals = list(heapq.merge(*busy_by_calendar.values()))
             
             # Get free intervals
-            free_intervals = self.get_free_intervals(busy_intervals, now, end)
+            free_intervals = self.get_free_intervals(
+                busy_intervals, now, end, already_sorted=True
+            )
             
             # Format response
             return [
                 {
-                    'start': start.isoformat(),
-                    'end': end.isoformat()
+                    'start': to_iso(start),
+                    'end': to_iso(end)
                 }
                 for start, end in free_intervals
-                if (end - start).total_seconds() >= MINIMUM_INTERVAL_MINUTES * 60
+                if end - start >= MINIMUM_INTERVAL_SECONDS
             ]
             
         except Exception as e:
@@ -175,6 +397,8 @@ class GoogleCalendarService:
                 body=event
             ).execute()
             
+            invalidate_free_busy_cache(to_timestamp(start_time), to_timestamp(end_time))
+            
             logger.info(f"Created event: {created_event.get('htmlLink')}")
             return created_event
             
@@ -195,42 +419,60 @@ class GooglePeopleService:
         )
         self.service = build('people', 'v1', credentials=self.creds)
 
+    def list_connections_page(self, page_token: Optional[str] = None) -> Dict[str, Any]:
+        """Fetch one page of the user's connections."""
+        return self.service.people().connections().list(
+            resourceName='people/me',
+            pageSize=1000,
+            personFields='names,emailAddresses,phoneNumbers',
+            fields='connections(resourceName,names/displayName,'
+                   'emailAddresses/value,phoneNumbers/value),nextPageToken',
+            pageToken=page_token
+        ).execute()
+
     async def get_contacts(self) -> List[Dict[str, str]]:
         """
         Get user's contacts with names, emails, and phone numbers.
         
+        The next page is requested as soon as a page arrives, so fetching
+        overlaps with processing the current page.
+        
         Returns:
             List of contact dictionaries with id, name, email, and phone
         """
+        loop = asyncio.get_running_loop()
+        next_page = None
         try:
             contacts = []
-            page_token = None
+            results = await asyncio.to_thread(self.list_connections_page)
             
             while True:
-                results = self.service.people().connections().list(
-                    resourceName='people/me',
-                    pageSize=1000,
-                    personFields='names,emailAddresses,phoneNumbers',
-                    pageToken=page_token
-                ).execute()
+                # Submit the next request to the executor now, so it runs while
+                # this page is processed rather than at the next await
+                page_token = results.get('nextPageToken')
+                next_page = loop.run_in_executor(
+                    None, self.list_connections_page, page_token
+                ) if page_token else None
                 
                 connections = results.get('connections', [])
                 
                 for person in connections:
                     contact = {
                         'id': person.get('resourceName', ''),
-                        'name': person.get('names', [{}])[0].get('displayName', ''),
-                        'email': person.get('emailAddresses', [{}])[0].get('value', ''),
-                        'phone': person.get('phoneNumbers', [{}])[0].get('value', '')
+                        'name': first_value(person.get('names'), 'displayName'),
+                        'email': first_value(person.get('emailAddresses'), 'value'),
+                        'phone': first_value(person.get('phoneNumbers'), 'value')
                     }
                     contacts.append(contact)
                 
-                page_token = results.get('nextPageToken')
-                if not page_token:
+                if next_page is None:
                     break
+                results = await next_page
                     
             return contacts
             
         except Exception as e:
+            if next_page is not None:
+                next_page.cancel()
             logger.error(f"Error fetching contacts: {str(e)}")
             raise
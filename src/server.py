@@ -1,17 +1,26 @@
 #!/usr/bin/env python3
 import os
 from typing import Dict, List, Tuple
-from dataclasses import dataclass
 from datetime import datetime
+import orjson
 from fastmcp import FastMCP
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+
+def orjson_serializer(result) -> str:
+    """Serialize tool results with orjson, which encodes datetimes as ISO strings natively.
+
+    Types orjson can't encode fall back to str, like FastMCP's default serializer.
+    """
+    return orjson.dumps(result, default=str, option=orjson.OPT_INDENT_2).decode()
+
+
 # Initialize FastMCP
 
-mcp = FastMCP("Scheduling MCP Server")
+mcp = FastMCP("Scheduling MCP Server", tool_serializer=orjson_serializer)
 
 propose_meeting_description = """When the user asks to propose a meeting to another user,
 find 2-3 one-hour slots over the next two weeks during business hours and draft an email 
@@ -26,11 +35,14 @@ Send it after approval and confirm that it is sent.
 
 @mcp.tool(description=propose_meeting_description)
 def propose_meeting(name: str, target_name: str, email: str, my_availability: str) -> str:
-    email = f"Hey {target_name}!\n\n" \
-        "Would love to meet you soon! Here are my available times over the next week:\n\n" \
-        f"{my_availability}\n\n" \
-        "Best regards,\n" \
-        f"{name}"
+    email = f"""Hey {target_name}!
+
+Would love to meet you soon! Here are my available times over the next week:
+
+{my_availability}
+
+Best regards,
+{name}"""
 
     return email
 
@@ -54,34 +66,31 @@ def respond_to_proposal():
     return
 
 
-@dataclass
-class TimeInterval:
-    start: datetime
-    end: datetime
-    
-    def overlaps(self, other: 'TimeInterval') -> bool:
-        return (self.start < other.end) and (other.start < self.end)
-    
-    def intersection(self, other: 'TimeInterval') -> 'TimeInterval':
-        if not self.overlaps(other):
-            return None
-        start = max(self.start, other.start)
-        end = min(self.end, other.end)
-        return TimeInterval(start=start, end=end)
-
-
 def find_availability_intersection(
-    slots1: List[TimeInterval],
-    slots2: List[TimeInterval]
-) -> List[TimeInterval]:
-    """Find all overlapping time intervals between two lists of time slots."""
+    slots1: List[Tuple[datetime, datetime]],
+    slots2: List[Tuple[datetime, datetime]]
+) -> List[Tuple[datetime, datetime]]:
+    """Find all overlapping time intervals between two lists of (start, end) slots.
+
+    Both lists must be sorted by start time, and slots within each list must not
+    overlap one another. The lists are walked once, advancing whichever slot
+    ends first.
+    """
     result = []
-    for slot1 in slots1:
-        for slot2 in slots2:
-            if slot1.overlaps(slot2):
-                intersection = slot1.intersection(slot2)
-                if intersection:
-                    result.append(intersection)
+    i = j = 0
+    while i < len(slots1) and j < len(slots2):
+        start1, end1 = slots1[i]
+        start2, end2 = slots2[j]
+        start = start1 if start1 > start2 else start2
+        end = end1 if end1 < end2 else end2
+        if start < end:
+            result.append((start, end))
+
+        # Advance whichever slot ends first; it cannot overlap anything further
+        if end1 <= end2:
+            i += 1
+        else:
+            j += 1
     return result
 
 
@@ -94,7 +103,8 @@ Args:
     friend_availability: List of {'start': datetime, 'end': datetime}
     
 Returns:
-    List of overlapping time intervals as dicts with 'start' and 'end' ISO format strings
+    List of overlapping time intervals as dicts with 'start' and 'end' datetimes,
+    serialized as ISO format strings in the tool response
 """
 
 
@@ -105,12 +115,9 @@ def find_common_availability(
 ) -> List[dict]:
     # Convert ISO format strings to datetime objects
     def parse_availability(avail_list):
-        result = []
-        for slot in avail_list:
-            start = datetime.fromisoformat(slot['start'])
-            end = datetime.fromisoformat(slot['end'])
-            result.append(TimeInterval(start=start, end=end))
-        return result
+        parse = datetime.fromisoformat
+        # Sorted once here so the intersection can sweep without re-sorting
+        return sorted((parse(slot['start']), parse(slot['end'])) for slot in avail_list)
     
     my_slots = parse_availability(my_availability)
     friend_slots = parse_availability(friend_availability)
@@ -118,9 +125,8 @@ def find_common_availability(
     # Find intersections
     common = find_availability_intersection(my_slots, friend_slots)
     
-    # Convert back to dict for JSON serialization
-    return [{'start': slot.start.isoformat(), 'end': slot.end.isoformat()} 
-            for slot in common]
+    # Datetimes are serialized to ISO format strings by the tool serializer
+    return [{'start': start, 'end': end} for start, end in common]
 
 def main():
     port = int(os.environ.get("PORT", 8000))